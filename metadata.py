@@ -5,9 +5,9 @@ Install ffmpeg (ffprobe.exe into this directory)
 pip install pillow ffmpeg-python
 '''
 
+import json
 import os
 import sys
-from pprint import pprint
 
 import ffmpeg
 import PIL.Image
@@ -23,15 +23,17 @@ class MediaFile(object):
         self.location = None
         self.size = os.path.getsize(path)
 
+    def dump(self):
+        ''' Write the file's EXIF data or movie metadata as JSON to stdout. '''
         if self.extension.lower() in ['jpg', 'jpeg', 'png']:
-            img = PIL.Image.open(self.path)
-            img_exif = img._getexif()
+            img_exif = PIL.Image.open(self.path)._getexif()
+            data = {}
             if img_exif:
-                pprint({
+                data = {
                     PIL.ExifTags.TAGS[k]: v
                     for k, v in img_exif.items()
                     if k in PIL.ExifTags.TAGS
-                })
+                }
 
             # exif = img.getexif()
             # for key, value in PIL.ExifTags.TAGS.items():
@@ -40,7 +42,10 @@ class MediaFile(object):
             # gps_info = exif.get_ifd(key)
             # print({ PIL.ExifTags.GPSTAGS.get(key, key): value for key, value in gps_info.items() })
         elif self.extension.lower() in ['mp4', 'mov', 'avi' ]:
-            pprint(ffmpeg.probe(self.path))
+            data = ffmpeg.probe(self.path)
+        else:
+            return
+        sys.stdout.write(json.dumps(data, indent=2, default=str))
 
 if __name__ == '__main__':
-    media = MediaFile(sys.argv[1])
+    MediaFile(sys.argv[1]).dump()
@@ -3,7 +3,7 @@
 
 '''
 Install ffmpeg (ffprobe.exe into this directory)
-pip install pillow geopy ffmpeg-python
+pip install pillow geopy
 
 TODO: Create main() so that there are not so many global variables
 TODO: Specify start date, so that we can ignore all older input files
@@ -16,22 +16,428 @@ __version__ = "1.1.0"
 
 from typing import List
 import argparse
+import atexit
+import concurrent.futures
+import functools
+import hashlib
+import json
 import os
 import datetime
+import io
 import logging
 import pickle
+import re
 import shutil
-import filecmp
 import signal
+import sqlite3
+import struct
+import subprocess
+import sys
+import threading
 import traceback
 import pathlib
 
-import ffmpeg
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+
 import geopy
+import geopy.extra.rate_limiter
 import PIL.Image
 import PIL.ExifTags
 
 INTERRUPT_PICKLE = 'interrupt.pickle'
+# Append-only log of placed source paths, one per line after a header line
+# naming the source directory. Flushed per file, so even a hard crash loses
+# at most the file in flight.
+PATHS_LOG = 'stats.log'
+
+# Set by the SIGINT handler; checked between futures and between copy chunks.
+_STOP = threading.Event()
+
+IMAGE_SUFFIXES = frozenset(('.jpg', '.jpeg', '.png'))
+MOVIE_SUFFIXES = frozenset(('.mp4', '.mov', '.avi'))
+MEDIA_SUFFIXES = IMAGE_SUFFIXES | MOVIE_SUFFIXES
+
+# The only EXIF tag we read outside the GPS IFD; it lives in the Exif
+# sub-IFD and is looked up by id to avoid building a full name->value dict.
+_DATETIME_ORIGINAL = 0x9003
+
+# EXIF sits at the start of a JPEG, so this header window is almost always
+# enough and spares reading whole images from disk or network mounts.
+_EXIF_HEADER_BYTES = 65536
+
+# One ISO-6709 component: a signed decimal number. Only numeric parts are
+# captured, so suffixes like '/CRSWGS_84' never reach float().
+_ISO6709_RE = re.compile(r'[+-]\d+(?:\.\d+)?')
+
+# Digits expected at the date position of the known filename patterns.
+_DATE_DIGITS_RE = re.compile(r'\d{6,8}')
+
+# Computed once; date.today() costs a syscall and is called per file.
+_CURRENT_YEAR = datetime.date.today().year
+
+# Multiply instead of dividing three times per progress line.
+_GB = 1.0 / (1024 ** 3)
+
+# Progress goes to INFO only every this many files (power of two); the
+# per-file lines are DEBUG so the hot loop skips two handler flushes.
+_PROGRESS_EVERY = 64
+
+# ffprobe invocation limited to the container-level tags we consume; the
+# tiny probe window keeps ffprobe from scanning codec samples, so it exits
+# after parsing the moov atom / container header.
+_FFPROBE_ARGS = [
+    'ffprobe', '-v', 'quiet',
+    '-probesize', '32k', '-analyzeduration', '0',
+    '-print_format', 'json',
+    '-show_entries',
+    'format_tags=creation_time,location,com.apple.quicktime.location.ISO6709',
+]
+
+class DirectoryIndex():
+    ''' Names and content signatures of destination directories.
+
+    One scandir per directory replaces per-file exists() probing, and
+    head/tail hashes of existing files are memoized so repeated
+    collisions against the same file never re-read it. Full-content
+    hashes are keyed by (path, mtime, size) and persisted, so later
+    runs never rehash unchanged destination files. '''
+
+    hashes_path = pathlib.Path('hashes.pickle')
+
+    def __init__(self):
+        self._names = {}
+        self._hashes = {}
+        self._full = None  # loaded lazily from hashes_path
+        self._full_dirty = False
+
+    def names(self, directory: pathlib.Path) -> set:
+        ''' Set of file names present in a directory (cached). '''
+        key = str(directory)
+        names = self._names.get(key)
+        if names is None:
+            try:
+                names = {entry.name for entry in os.scandir(directory)}
+            except FileNotFoundError:
+                names = set()
+            self._names[key] = names
+        return names
+
+    def head_tail_hash(self, path: pathlib.Path, size: int) -> bytes:
+        ''' Memoized head/tail hash of an existing file. '''
+        key = str(path)
+        digest = self._hashes.get(key)
+        if digest is None:
+            digest = _head_tail_hash(path, size)
+            self._hashes[key] = digest
+        return digest
+
+    def full_hash(self, path: pathlib.Path) -> bytes:
+        ''' Streamed hash of an existing file, reused across runs. '''
+        if self._full is None:
+            self._full = {}
+            if self.hashes_path.exists():
+                with open(self.hashes_path, 'rb') as pfile:
+                    self._full = pickle.load(pfile)
+            atexit.register(self.persist)
+
+        stat = os.stat(path)
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        digest = self._full.get(key)
+        if digest is None:
+            digest = _full_hash(path)
+            self._full[key] = digest
+            self._full_dirty = True
+        return digest
+
+    def persist(self):
+        ''' Write the full-content hashes to disk. '''
+        if not self._full_dirty:
+            return
+        tmp_path = self.hashes_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as pfile:
+            pickle.dump(self._full, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.hashes_path)
+        self._full_dirty = False
+
+    def add(self, path: pathlib.Path):
+        ''' Register a freshly copied file. '''
+        self.names(path.parent).add(path.name)
+
+# The destination tree index shared by all MediaFile placements.
+_DEST_INDEX = DirectoryIndex()
+
+# FICLONE ioctl from linux/fs.h; the fcntl module does not expose it.
+_FICLONE = 0x40049409
+
+def _fastcopy(src: pathlib.Path, dst: pathlib.Path):
+    ''' Copy src to dst in-kernel when the platform supports it.
+
+    Tries an O(1) reflink clone first (btrfs/XFS), then copy_file_range,
+    then sendfile — all of which avoid bouncing every block through a
+    userspace buffer; anything else falls back to shutil.copyfile. '''
+    if not hasattr(os, 'copy_file_range') and not hasattr(os, 'sendfile'):
+        shutil.copyfile(src, dst)
+        return
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            if fcntl is not None:
+                try:
+                    fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                    return
+                except OSError:
+                    # Not a CoW filesystem, or src and dst on different
+                    # devices; copy the bytes instead.
+                    pass
+            size = os.fstat(fsrc.fileno()).st_size
+            # Tell the kernel we read front to back so readahead ramps up.
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(
+                    fsrc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            use_cfr = hasattr(os, 'copy_file_range')
+            remaining = size
+            while remaining > 0:
+                # Bounded chunks so a SIGINT is honored even mid-copy of a
+                # multi-GB movie.
+                if _STOP.is_set():
+                    raise KeyboardInterrupt()
+                if use_cfr:
+                    try:
+                        copied = os.copy_file_range(
+                            fsrc.fileno(), fdst.fileno(),
+                            min(remaining, 1 << 26))
+                    except OSError:
+                        # Cross-device or unsupported filesystem; sendfile
+                        # still copies in-kernel.
+                        use_cfr = False
+                        continue
+                    if copied == 0:
+                        use_cfr = False
+                        continue
+                elif hasattr(os, 'sendfile'):
+                    copied = os.sendfile(
+                        fdst.fileno(), fsrc.fileno(),
+                        size - remaining, 1 << 22)
+                    if copied == 0:
+                        break
+                else:
+                    fsrc.seek(size - remaining)
+                    shutil.copyfileobj(fsrc, fdst)
+                    break
+                remaining -= copied
+            # Bulk imports read each file once; drop its pages instead of
+            # letting them crowd out the rest of the page cache.
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fsrc.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        shutil.copyfile(src, dst)
+    except KeyboardInterrupt:
+        # Do not leave a half-written destination file behind.
+        os.unlink(dst)
+        raise
+
+def _full_hash(path) -> bytes:
+    ''' Streamed hash over a file's whole content. '''
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.digest()
+
+def _head_tail_hash(path, size: int) -> bytes:
+    ''' Hash of the first and last 64 KiB of a file (cheap duplicate probe). '''
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        digest.update(file.read(65536))
+        if size > 65536:
+            file.seek(max(size - 65536, 65536))
+            digest.update(file.read(65536))
+    return digest.digest()
+
+def _fast_jpeg_exif(head: bytes):
+    ''' Extract DateTimeOriginal and GPSInfo straight from a JPEG header.
+
+    Scans the APP1 segment with struct.unpack_from over the already-read
+    buffer instead of going through PIL's Image machinery — a fraction of
+    the work for the two tags we need. Returns the tag dict ({} when the
+    JPEG simply has no EXIF), or None when the buffer cannot be parsed
+    (not a JPEG, truncated segment, ...) and the caller should fall back
+    to PIL. '''
+    if not head.startswith(b'\xff\xd8'):
+        return None
+    try:
+        # Find the APP1 segment holding the EXIF payload.
+        app1 = None
+        saw_sos = False
+        offset = 2
+        while offset + 4 <= len(head):
+            if head[offset] != 0xFF:
+                return None
+            marker = head[offset + 1]
+            if marker in (0xD8, 0xD9, 0x01) or 0xD0 <= marker <= 0xD7:
+                offset += 2  # parameterless marker
+                continue
+            length = struct.unpack_from('>H', head, offset + 2)[0]
+            if marker == 0xE1 and head[offset + 4:offset + 10] == b'Exif\x00\x00':
+                app1 = (offset + 10, offset + 2 + length)
+                break
+            if marker == 0xDA:
+                saw_sos = True
+                break  # start of scan; no EXIF ahead of the image data
+            offset += 2 + length
+        if app1 is None:
+            # Only reaching the image data proves there is no EXIF. If the
+            # scan merely ran out of buffer (EXIF behind a large ICC/XMP
+            # segment), the caller must retry on the full file.
+            return {} if saw_sos else None
+        base, end = app1
+        if end > len(head):
+            return None  # APP1 extends beyond the header window
+
+        # TIFF header: byte order, then the offset of IFD0.
+        byteorder = head[base:base + 2]
+        if byteorder == b'II':
+            endian = '<'
+        elif byteorder == b'MM':
+            endian = '>'
+        else:
+            return None
+
+        def ifd_entries(ifd_offset):
+            ''' Yield (tag, type, count, raw value/offset) of one IFD. '''
+            count = struct.unpack_from(endian + 'H', head, base + ifd_offset)[0]
+            for index in range(count):
+                yield struct.unpack_from(
+                    endian + 'HHL4s', head, base + ifd_offset + 2 + index * 12)
+
+        def value_offset(raw):
+            return struct.unpack(endian + 'L', raw)[0]
+
+        def ascii_value(count, raw):
+            if count <= 4:
+                data = raw[:count]
+            else:
+                data_offset = base + value_offset(raw)
+                data = head[data_offset:data_offset + count]
+            return data.split(b'\x00', 1)[0].decode('ascii', 'replace')
+
+        def rational3(raw):
+            parts = struct.unpack_from(
+                endian + '6L', head, base + value_offset(raw))
+            return tuple(
+                parts[index] / (parts[index + 1] or 1)
+                for index in range(0, 6, 2))
+
+        # IFD0 only matters for the Exif and GPS IFD pointers.
+        exif_offset = None
+        gps_offset = None
+        for tag, _, _, raw in ifd_entries(struct.unpack_from(endian + 'L', head, base + 4)[0]):
+            if tag == 0x8769:
+                exif_offset = value_offset(raw)
+            elif tag == 0x8825:
+                gps_offset = value_offset(raw)
+
+        tags = {}
+        if exif_offset is not None:
+            for tag, value_type, count, raw in ifd_entries(exif_offset):
+                if tag == _DATETIME_ORIGINAL and value_type == 2:
+                    tags['DateTimeOriginal'] = ascii_value(count, raw)
+                    break
+        if gps_offset is not None:
+            gpsinfo = {}
+            for tag, value_type, count, raw in ifd_entries(gps_offset):
+                if value_type == 2:
+                    gpsinfo[tag] = ascii_value(count, raw)
+                elif value_type == 5 and count == 3:
+                    gpsinfo[tag] = rational3(raw)
+            if gpsinfo:
+                tags['GPSInfo'] = gpsinfo
+        return tags
+    except (struct.error, IndexError, UnicodeDecodeError):
+        return None
+
+def _walk(root: pathlib.Path, recursive: bool):
+    ''' Yield media files below root using one scandir per directory.
+
+    DirEntry answers is_dir/is_file from the directory read itself (no
+    extra stat per entry), and the suffix filter keeps non-media files
+    from ever reaching MediaFile. '''
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError as scandir_error:
+            # One unreadable directory must not abort the whole run
+            # (Path.glob used to skip these silently).
+            logging.warning('%s: skipped: %s', directory, scandir_error)
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    suffix = os.path.splitext(entry.name)[1].lower()
+                    if suffix in MEDIA_SUFFIXES:
+                        # Pass the cached stat along so nothing downstream
+                        # has to stat the file again.
+                        yield pathlib.Path(entry.path), entry.stat(follow_symlinks=False).st_size
+
+def _quant(value: float) -> float:
+    ''' Quantize a coordinate to ~100m so nearby photos share a cache entry. '''
+    return round(value, 3)
+
+def _dms(value) -> float:
+    ''' Convert an EXIF (degrees, minutes, seconds) triple to decimal degrees. '''
+    degrees, minutes, seconds = value
+    return (float(degrees) * 3600.0 + float(minutes) * 60.0 + float(seconds)) / 3600.0
+
+# Matches both the EXIF format ('2021:08:15 12:30:00') and the movie
+# metadata variants ('2021-08-15T12:30:00.000000Z', ...); any trailing
+# fraction or timezone suffix is ignored.
+_DATETIME_RE = re.compile(
+    r'(\d{4})[-:](\d{2})[-:](\d{2})[T ](\d{2}):(\d{2}):(\d{2})')
+
+def _parse_datetime(value: str):
+    ''' Parse a 'YYYY?MM?DD?HH:MM:SS' timestamp, or return None.
+
+    One compiled regex match replaces the strptime cascade and never
+    raises on malformed input. '''
+    match = _DATETIME_RE.match(value)
+    if match:
+        try:
+            return datetime.datetime(*map(int, match.groups()))
+        except ValueError:
+            # Digits matched but are out of range (month 13, ...).
+            return None
+    return None
+
+@functools.lru_cache(maxsize=8192)
+def _parse_filename_date(candidate: str, short_year: bool):
+    ''' Parse 'YYYYMMDD' (or 'YYMMDD' when short_year) into a datetime.
+
+    Integer slicing instead of strptime, and cached — bursts of files from
+    one day share a handful of distinct date strings. Returns None when the
+    digits are not a real calendar date. '''
+    if short_year:
+        if len(candidate) != 6:
+            return None
+        year = int(candidate[:2])
+        # Same century pivot as strptime's %y.
+        year += 2000 if year < 69 else 1900
+        month, day = int(candidate[2:4]), int(candidate[4:6])
+    else:
+        if len(candidate) != 8:
+            return None
+        year, month, day = (
+            int(candidate[:4]), int(candidate[4:6]), int(candidate[6:8]))
+    try:
+        return datetime.datetime(year, month, day)
+    except ValueError:
+        return None
 
 # Setup logging to file
 logging.basicConfig(
@@ -48,44 +454,138 @@ formatter = logging.Formatter('%(levelname)-8s %(message)s')
 console.setFormatter(formatter)
 logging.getLogger('').addHandler(console)
 
+# Address keys probed in priority order to build a location name; each entry
+# applies only when all of its keys are present and is joined with '_'.
+_LOC_PRIORITY = (
+    ('village', 'suburb'),
+    ('town', 'suburb'),
+    ('suburb',),
+    ('village',),
+    ('town',),
+    ('state',),
+)
+
 class GeoLocator():
     ''' This class can return the address of geolocation. '''
 
+    db_path = pathlib.Path('coordinates.sqlite')
+    # Cache file written by older versions; migrated into the db on startup.
     pickle_path = pathlib.Path('coordinates.pickle')
-    coordinates = {}
+
+    # Commit to disk after this many new entries (and at exit).
+    persist_interval = 32
 
     def __init__(self, user_agent: str = 'sort.py'):
         self.geolocator = geopy.geocoders.Nominatim(user_agent=user_agent)
-
-        if self.pickle_path.exists():
-            logging.info('Load %s ...', self.pickle_path)
-            with open(self.pickle_path, 'rb') as pfile:
-                self.coordinates = pickle.load(pfile)
+        # Nominatim's usage policy allows 1 request/s; enforce it here
+        # instead of relying on natural pacing between cache misses.
+        # swallow_exceptions would turn an outage into a None return (and
+        # an AttributeError on .raw); main() handles GeocoderUnavailable
+        # itself, so let it propagate.
+        self._rate_limited_reverse = geopy.extra.rate_limiter.RateLimiter(
+            self.geolocator.reverse, min_delay_seconds=1,
+            swallow_exceptions=False)
+        self._dirty = 0
+        # In-memory front cache for location_for, keyed by quantized
+        # (lat, lon) tuples: hits skip both float formatting and sqlite.
+        self._locations = {}
+        self.db = sqlite3.connect(self.db_path)
+        # WAL keeps commits incremental (no full-journal rewrite) and lets
+        # concurrent readers see the cache while a commit is in flight.
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS coords(k TEXT PRIMARY KEY, v BLOB)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS locations(k TEXT PRIMARY KEY, v TEXT)')
+        self.__migrate_pickle()
+
+        atexit.register(self.persist)
+
+    def __migrate_pickle(self):
+        ''' Import a coordinates.pickle left behind by an older version. '''
+        if not self.pickle_path.exists():
+            return
+        logging.info('Migrate %s into %s ...', self.pickle_path, self.db_path)
+        with open(self.pickle_path, 'rb') as pfile:
+            for key, value in pickle.load(pfile).items():
+                self.db.execute('INSERT OR REPLACE INTO coords VALUES(?,?)',
+                    (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+        self.db.commit()
+        self.pickle_path.unlink()
 
     def persist(self):
-        ''' Write already fetched locations into pickle file. '''
-        with open(self.pickle_path, 'wb') as pfile:
-            pickle.dump(self.coordinates, pfile)
+        ''' Commit pending cache inserts to disk. '''
+        if self._dirty:
+            self.db.commit()
+            self._dirty = 0
+
+    @functools.lru_cache(maxsize=65536)
+    def __reverse(self, latitude: float, longitude: float):
+        ''' Reverse-geocode quantized coordinates (memoized per session). '''
+        return self._rate_limited_reverse(f'{latitude},{longitude}').raw['address']
 
     def address(self, latitude: float, longitude: float):
         ''' Get address of geolocation '''
-        # Shorten coordinates by rounding.
-        coordinates = f'{round(latitude, 3)},{round(longitude, 3)}'
-
-        if coordinates in self.coordinates:
+        # Quantize so nearby photos share one cache entry and one request.
+        latitude = _quant(latitude)
+        longitude = _quant(longitude)
+        coordinates = f'{latitude},{longitude}'
+
+        row = self.db.execute(
+            'SELECT v FROM coords WHERE k=?', (coordinates,)).fetchone()
+        if row:
             logging.debug('location from cache')
-            return self.coordinates[coordinates]
+            return pickle.loads(row[0])
 
         try:
-            location = self.geolocator.reverse(f'{latitude},{longitude}').raw['address']
-            self.coordinates[coordinates] = location
-            self.persist()
+            location = self.__reverse(latitude, longitude)
+            self.db.execute('INSERT OR REPLACE INTO coords VALUES(?,?)',
+                (coordinates, pickle.dumps(location, protocol=pickle.HIGHEST_PROTOCOL)))
+            self._dirty += 1
+            if self._dirty >= self.persist_interval:
+                self.persist()
         except ValueError:
             logging.error('lat: %s and lon: %s are not correct.', latitude, longitude)
             return None
 
         return location
 
+    def location_for(self, latitude: float, longitude: float):
+        ''' Get the location name of geolocation.
+
+        Caches the already-resolved name, so the address fallback cascade
+        runs once per unique coordinate instead of once per file. '''
+        key = (_quant(latitude), _quant(longitude))
+        if key in self._locations:
+            return self._locations[key]
+
+        coordinates = f'{key[0]},{key[1]}'
+        row = self.db.execute(
+            'SELECT v FROM locations WHERE k=?', (coordinates,)).fetchone()
+        if row:
+            location = row[0] or None
+        else:
+            location = self.__address2location(
+                self.address(key[0], key[1]), coordinates)
+            self.db.execute('INSERT OR REPLACE INTO locations VALUES(?,?)',
+                (coordinates, location or ''))
+            self._dirty += 1
+            if self._dirty >= self.persist_interval:
+                self.persist()
+
+        self._locations[key] = location
+        return location
+
+    def __address2location(self, address, coordinates: str):
+        ''' Get location name from address object '''
+        if not address:
+            return None
+        for keys in _LOC_PRIORITY:
+            parts = [address.get(key) for key in keys]
+            if all(parts):
+                return '_'.join(parts)
+        logging.warning('%s: Could not determine location from address: %s',
+            coordinates, str(address))
+        return None
+
 class UnknownMedia(Exception):
     '''Raised when trying to open a file that is not a known image or movie file type.'''
 
@@ -95,52 +595,112 @@ class DuplicateException(Exception):
 class MediaFile(object):
     ''' Multimedia object (image or movie) '''
 
-    def __init__(self, filepath: pathlib.Path, locations: GeoLocator):
+    def __init__(self, filepath: pathlib.Path, size: int = None):
         self.path = filepath
         self.location = None
-        self.size = os.path.getsize(filepath)
-
-        if self.path.suffix.lower() in ['.jpg', '.jpeg', '.png']:
-            self.exif = self.__read_exif()
-            self.location = self.__exif_location(locations)
-            self.date = self.__exif_date()
-        elif self.path.suffix.lower() in ['.mp4', '.mov', '.avi' ]:
-            self.metadata = self.__read_metadata()
-            self.location = self.__metadata_location(locations)
-            self.date = self.__metadata_date()
-        else:
+        self.coordinates = None
+        self.__hash = None       # head/tail hash, computed lazily
+        self.__full_hash = None  # full-content hash, computed lazily
+
+        # Dispatch before any stat work so unsupported files cost nothing
+        # beyond the suffix lookup.
+        reader = self.__READERS.get(self.path.suffix.lower())
+        if reader is None:
             raise UnknownMedia()
+        self.size = size if size is not None else os.path.getsize(filepath)
+        reader(self)
+
+    @classmethod
+    def from_cache(cls, filepath: pathlib.Path, size: int, date, coordinates):
+        ''' Rebuild a MediaFile from cached probe results.
+
+        Used on resumed runs so files that were probed before an
+        interruption do not pay for EXIF/ffprobe again. '''
+        media = cls.__new__(cls)
+        media.path = filepath
+        media.location = None
+        media.coordinates = coordinates
+        media.date = date
+        media.size = size
+        media.__hash = None
+        media.__full_hash = None
+        return media
+
+    def __read_image(self):
+        ''' Extract coordinates and date from an image file.
+
+        The raw exif dict stays local so the object remains small and
+        picklable (it travels between worker processes). '''
+        exif = self.__read_exif()
+        self.coordinates = self.__exif_coordinates(exif)
+        self.date = self.__exif_date(exif)
+
+    def __read_movie(self):
+        ''' Extract coordinates and date from a movie file. '''
+        metadata = self.__read_metadata()
+        self.coordinates = self.__metadata_coordinates(metadata)
+        self.date = self.__metadata_date(metadata)
+
+    # Suffix -> reader method; one dict lookup replaces the per-file
+    # list-literal membership scans.
+    __READERS = {}
+    __READERS.update(dict.fromkeys(IMAGE_SUFFIXES, __read_image))
+    __READERS.update(dict.fromkeys(MOVIE_SUFFIXES, __read_movie))
+
+    def resolve_location(self, locations: GeoLocator):
+        ''' Reverse-geocode the coordinates (if any) into a location name.
+
+        Called from the main thread only, so that requests to the
+        geocoder stay serialized. '''
+        if self.coordinates:
+            self.location = locations.location_for(
+                self.coordinates[0], self.coordinates[1])
 
     def __read_exif(self):
-        ''' Read image EXIF data '''
+        ''' Read the EXIF fields we use, without decoding any pixels.
+
+        Only the first 64 KiB of the file is read; when that window does
+        not yield any metadata the whole file is retried once. '''
         try:
-            img = PIL.Image.open(self.path)
-            img_exif = img._getexif()
-            if img_exif:
-                return {
-                    PIL.ExifTags.TAGS[k]: v
-                    for k, v in img_exif.items()
-                    if k in PIL.ExifTags.TAGS
-                }
+            with open(self.path, 'rb') as file:
+                head = file.read(_EXIF_HEADER_BYTES)
+            # Fast path: scan the APP1 segment directly.
+            tags = _fast_jpeg_exif(head)
+            if tags is not None:
+                return tags
+            try:
+                tags = self.__exif_tags(io.BytesIO(head))
+            except OSError:
+                # Parser tripped over the truncation; retry below.
+                tags = {}
+            if not tags and self.size > len(head):
+                tags = self.__exif_tags(self.path)
+            return tags
         except OSError as os_error:
-            logging.error(f'Error reading EXIF: %s: %s', self.path, os_error)
+            logging.error('Error reading EXIF: %s: %s', self.path, os_error)
         return {}
 
-    def __exif_location(self, locations: GeoLocator) -> str:
-        ''' Extract location from EXIF '''
-        if 'GPSInfo' not in self.exif:
+    def __exif_tags(self, source):
+        ''' Extract DateTimeOriginal and GPSInfo from a path or buffer. '''
+        exif = PIL.Image.open(source).getexif()
+        tags = {}
+        datetimeorig = exif.get_ifd(PIL.ExifTags.IFD.Exif).get(_DATETIME_ORIGINAL)
+        if datetimeorig:
+            tags['DateTimeOriginal'] = datetimeorig
+        gpsinfo = exif.get_ifd(PIL.ExifTags.IFD.GPSInfo)
+        if gpsinfo:
+            tags['GPSInfo'] = dict(gpsinfo)
+        return tags
+
+    def __exif_coordinates(self, exif):
+        ''' Extract GPS coordinates from EXIF '''
+        if 'GPSInfo' not in exif:
             return None
 
-        gpsinfo = self.exif['GPSInfo']
+        gpsinfo = exif['GPSInfo']
 
         try:
-            degrees, minutes, seconds = gpsinfo[2]
-            latitude = float(degrees) + float(minutes) / float(60) + float(seconds) / float(3600)
-
-            degrees, minutes, seconds = gpsinfo[4]
-            longitude = float(degrees) + float(minutes) / float(60) + float(seconds) / float(3600)
-
-            return self.__address2location(locations.address(latitude, longitude))
+            return (_dms(gpsinfo[2]), _dms(gpsinfo[4]))
         except KeyError:
             logging.error('%s: GPSInfo not as expected: "%s"', self.path, str(gpsinfo))
             return None
@@ -148,22 +708,25 @@ class MediaFile(object):
     def __read_metadata(self):
         ''' Read metadata from movie file '''
         try:
-            return ffmpeg.probe(self.path)
+            probe = subprocess.run(
+                _FFPROBE_ARGS + [str(self.path)],
+                capture_output=True, check=True)
+            return json.loads(probe.stdout)
         except Exception as ffmpeg_exception:
             logging.error('%s: Reading metadata failed: "%s"', self.path, str(ffmpeg_exception))
             return {}
 
-    def __metadata_date(self):
+    def __metadata_date(self, metadata):
         ''' Extract date from movie metadata '''
         # We value the date encoded in the filename more than the one in the exif data.
         date = self.__guess_date_by_filename()
         if date:
             return date
 
-        if not 'format' in self.metadata:
+        if not 'format' in metadata:
             return date
 
-        metadata_format = self.metadata['format']
+        metadata_format = metadata['format']
         if not 'tags' in metadata_format:
             return date
 
@@ -173,39 +736,22 @@ class MediaFile(object):
 
         creation_time = tags['creation_time']
 
-        # Try multiple format strings
-        for format_str in ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%fZ']:
-            try:
-                return datetime.datetime.strptime(creation_time, format_str)
-            except ValueError:
-                continue
-
-        logging.error('%s: Unknown date format in metadata: "%s".', self.path, creation_time)
-        return date
+        parsed = _parse_datetime(creation_time)
+        if parsed is None:
+            logging.error('%s: Unknown date format in metadata: "%s".', self.path, creation_time)
+            return date
+        return parsed
 
     def __iso6709(self, val: str) -> List[str]:
         ''' Convert ISO-6709 Geolocation string into list of latitude, longitude, height. '''
-        ret = []
-        part = ''
-        for char in val:
-            if char in ('+', '-') and part != '':
-                ret.append(part)
-                part = ''
-            part += char
-
-        if part != '':
-            if part.endswith('/'):
-                part = part[:-1]
-            ret.append(part)
-
-        return ret
-
-    def __metadata_location(self, locations: GeoLocator):
-        ''' Get location from movie metadate '''
-        if not 'format' in self.metadata:
+        return _ISO6709_RE.findall(val)
+
+    def __metadata_coordinates(self, metadata):
+        ''' Get GPS coordinates from movie metadata '''
+        if not 'format' in metadata:
             return None
 
-        metadata_format = self.metadata['format']
+        metadata_format = metadata['format']
         if not 'tags' in metadata_format:
             return None
 
@@ -219,137 +765,126 @@ class MediaFile(object):
 
         geolocation = self.__iso6709(location)
         if len(geolocation) >= 2:
-            return self.__address2location(
-                locations.address(
-                    float(geolocation[0]),
-                    float(geolocation[1])))
+            return (float(geolocation[0]), float(geolocation[1]))
         logging.error('%s: Unexpected location format in metadata: "%s"', self.path, location)
         return None
 
-    def __exif_date(self):
+    def __exif_date(self, exif):
         ''' Get date from image exif data '''
         # We value the date encoded in the filename more than the one in the exif data.
         date = self.__guess_date_by_filename()
         if date:
             return date
 
-        if 'DateTimeOriginal' not in self.exif:
+        if 'DateTimeOriginal' not in exif:
             return date
 
-        datetimeorig = self.exif['DateTimeOriginal']
-        try:
-            return datetime.datetime.strptime(datetimeorig, '%Y:%m:%d %H:%M:%S')
-        except ValueError:
+        datetimeorig = exif['DateTimeOriginal']
+        parsed = _parse_datetime(datetimeorig)
+        if parsed is None:
             logging.error('%s: Unknown datetime in exif data: "%s"', self.path, datetimeorig)
             return date
+        return parsed
 
-    def __address2location(self, address) -> str:
-        ''' Get location name from address object '''
-        if not address:
-            return None
-        if 'suburb' in address:
-            if 'village' in address:
-                return address['village'] + '_' + address['suburb']
-            if 'town' in address:
-                return address['town'] + '_' + address['suburb']
-            return address['suburb']
-        if 'village' in address:
-            return address['village']
-        if 'town' in address:
-            return address['town']
-        if 'state' in address:
-            return address['state']
-        logging.warning('%s: Could not determine location from address: %s',
-            self.path, str(address))
-        return None
-
-    def __dest_directory(self, dst_base: pathlib.Path) -> pathlib.Path:
+    def dest_directory(self, dst_base: pathlib.Path) -> pathlib.Path:
         ''' Return dest directory of this file '''
-        directory = dst_base
-
-        if self.date:
-            directory /= self.date.strftime('%Y/%m')
-        else:
-            directory /= '0000'
-
+        parts = [self.date.strftime('%Y/%m') if self.date else '0000']
         if self.location:
-            directory /= self.location
-
-        return directory
+            parts.append(self.location)
+        return pathlib.Path(dst_base, *parts)
 
-    def __dest_name(self, duplicate: int) -> pathlib.Path:
+    def __dest_name(self, duplicate: int) -> str:
         ''' Get the dest file name '''
         if 0 == duplicate:
             return self.path.name
-        return pathlib.Path(f'{self.path.stem}_{duplicate}{self.path.suffix}')
+        return f'{self.path.stem}_{duplicate}{self.path.suffix}'
     
     def dest_path(self, dst_base: pathlib.Path) -> pathlib.Path:
         # Get full dest directory
-        directory = self.__dest_directory(dst_base)
-        dst = pathlib.Path()
+        directory = self.dest_directory(dst_base)
+        names = _DEST_INDEX.names(directory)
+        # Probe with plain strings; the PurePath machinery is only paid
+        # once for the returned result.
+        dir_str = os.fspath(directory)
 
         # Add a suffix to the filename until a new filename was found.
+        # The cached name set answers most probes; content comparison only
+        # runs on an actual name collision.
         duplicate = 0
         while True:
             filename = self.__dest_name(duplicate)
-            dst = directory / filename
-            if dst.exists():
-                if filecmp.cmp(dst, self.path):
+            if filename in names:
+                dst = os.path.join(dir_str, filename)
+                if self.__same_content(dst):
                     raise DuplicateException(
                         f'already exists at {dst}')
                 duplicate += 1
             else:
                 break
-        
-        return dst
+
+        return pathlib.Path(dir_str, filename)
+
+    def __same_content(self, dst: str) -> bool:
+        ''' Whether dst holds the same bytes as this file.
+
+        Compares sizes, then head/tail hashes, and only when both match
+        compares streamed full-content hashes — so the common "same name,
+        different file" case never reads either file in full, and the
+        destination's full hash survives across runs via the index. '''
+        if os.path.getsize(dst) != self.size:
+            return False
+
+        if self.__hash is None:
+            self.__hash = _head_tail_hash(self.path, self.size)
+
+        if _DEST_INDEX.head_tail_hash(dst, self.size) != self.__hash:
+            return False
+
+        if self.__full_hash is None:
+            self.__full_hash = _full_hash(self.path)
+        return _DEST_INDEX.full_hash(dst) == self.__full_hash
 
     def copy(self, dst: pathlib.Path):
-        ''' Copy the file into its dest directory '''
+        ''' Copy the file into its dest directory.
 
-        # Create dest directory
-        if not dst.parent.exists():
-            os.makedirs(dst.parent)
-    
-        shutil.copyfile(self.path, dst)
+        The caller is responsible for creating dst's directory; main()
+        copies grouped by directory and creates each one exactly once. '''
+        _fastcopy(self.path, dst)
+        _DEST_INDEX.add(dst)
 
     def __guess_date_by_filename(self):
         ''' Guess the media date by its filename '''
-        if self.path.stem.startswith('IMG_') or self.path.stem.startswith('MOV_'):
-            try:
-                date = datetime.datetime.strptime(self.path.stem.split('_')[1], '%Y%m%d')
-                # Validate
-                if date.year >= 1990 and date.year <= datetime.date.today().year:
-                    return date
-            except ValueError:
-                pass
-        elif self.path.stem.startswith('FILE'):
-            try:
-                date = datetime.datetime.strptime(self.path.stem[4:10], '%y%m%d')
-                # Validate
-                if date.year >= 1990 and date.year <= datetime.date.today().year:
-                    return date
-            except ValueError:
-                pass
-        elif len(self.path.stem) > 8:
+        stem = self.path.stem
+        if stem.startswith(('IMG_', 'MOV_')):
+            candidate = stem.split('_')[1]
+            short_year = False
+        elif stem.startswith('FILE'):
+            candidate = stem[4:10]
+            short_year = True
+        elif len(stem) > 8:
             # Sometimes filenames start with the date.
-            try:
-                date = datetime.datetime.strptime(self.path.stem[:8], '%Y%m%d')
-                # Validate
-                if date.year >= 1990 and date.year <= datetime.date.today().year:
-                    return date
-            except ValueError:
-                pass
-        return None
+            candidate = stem[:8]
+            short_year = False
+        else:
+            return None
 
-# Whether to interrupt the sorting.
-interrupt_sort = False
+        # Cheap pre-check so undated filenames never reach the parser
+        # (and never pollute its cache).
+        if not _DATE_DIGITS_RE.fullmatch(candidate):
+            return None
+
+        date = _parse_filename_date(candidate, short_year)
+
+        # Validate
+        if date and 1990 <= date.year <= _CURRENT_YEAR:
+            return date
+        return None
 
 def signal_handler(signum, frame):
     '''
     Interrupt handler for CTRL-C
     '''
-    global interrupt_sort
-    interrupt_sort = True
+    _STOP.set()
 
 # Define signal handler
 signal.signal(signal.SIGINT, signal_handler)
@@ -368,6 +903,11 @@ def main():
         '--dryrun',
         help='Do a dry run without any actual changes',
         action='store_true')
+    parser.add_argument(
+        '--resume',
+        help='Continue an interrupted run: ask interactively (default), or yes/no for scripted use',
+        choices=['ask', 'yes', 'no'],
+        default='ask')
     args = parser.parse_args()
 
     source_directory = args.source_directory
@@ -382,89 +922,224 @@ def main():
         'source': source_directory,
         'paths': set(),
         'bytes': 0,
-        'duplicates': 0
+        'duplicates': 0,
+        # Probe results (date, coordinates) of files that were read but not
+        # yet placed when the run was interrupted.
+        'mediacache': {}
     }
 
     # Try to load a previous state.
-    if os.path.exists(INTERRUPT_PICKLE):
+    resume = False
+    if args.resume != 'no' and os.path.exists(INTERRUPT_PICKLE):
         with open(INTERRUPT_PICKLE, 'rb') as file:
             stats_loaded = pickle.load(file)
             if stats_loaded['source'] == source_directory:
-                user_input = input('Continue interrupted run? [Yn]')
+                # Only prompt on an interactive terminal; batch runs must
+                # never block on stdin.
+                user_input = ''
+                if args.resume == 'ask' and sys.stdin.isatty():
+                    user_input = input('Continue interrupted run? [Yn]')
                 if user_input != 'n':
+                    # Older pickles carried the paths set (as Path objects
+                    # even earlier); seed the in-memory set from it once —
+                    # it is rewritten into PATHS_LOG below.
+                    stats_loaded['paths'] = {
+                        os.fspath(p) for p in stats_loaded.pop('paths', ())}
+                    stats_loaded.setdefault('mediacache', {})
                     stats = stats_loaded
+                    resume = True
+
+    # Processed paths are persisted per file in PATHS_LOG rather than in the
+    # interrupt pickle: appending one line per placement is O(1), while
+    # re-pickling the whole set would grow quadratic over a large import.
+    log_header = os.fspath(source_directory)
+    if resume and os.path.exists(PATHS_LOG):
+        with open(PATHS_LOG, 'r', encoding='utf-8') as file:
+            lines = file.read().splitlines()
+        if lines and lines[0] == log_header:
+            stats['paths'].update(lines[1:])
+    # Rewritten once per startup so the header and any paths migrated from
+    # an old pickle are in place; afterwards it is append-only.
+    paths_log = open(PATHS_LOG, 'w', encoding='utf-8')
+    paths_log.write(log_header + '\n')
+    for processed_path in stats['paths']:
+        paths_log.write(processed_path + '\n')
+    paths_log.flush()
+
+    def mark_processed(key):
+        ''' Record a handled source path durably (one line, flushed). '''
+        stats['paths'].add(key)
+        paths_log.write(key + '\n')
+        paths_log.flush()
+
+    def flush_stats():
+        ''' Persist progress so even an abnormal exit can be resumed. '''
+        state = dict(stats)
+        state.pop('paths', None)  # durable in PATHS_LOG already
+        with open(INTERRUPT_PICKLE, 'wb') as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Make sure progress survives any way the process goes down, not just
+    # the interrupt paths the loop below handles explicitly.
+    atexit.register(flush_stats)
 
     interrupted = False
-    pattern = '*'
-    if args.recursive:
-        pattern = '**/*'
-    files = [f for f in source_directory.glob(pattern) if os.path.isfile(f)]
-    for path in files:
-        if interrupt_sort:
-            logging.info('Keyboard interrupt')
-            with open(INTERRUPT_PICKLE, 'wb') as file:
-                pickle.dump(stats, file)
+    files = list(_walk(source_directory, args.recursive))
+    total = len(files)
+
+    # Hoisted out of the loop: whether progress lines are emitted at all.
+    log_progress = logging.getLogger().isEnabledFor(logging.INFO)
+
+    # Pass 1: probe files (EXIF/ffprobe) in worker processes; geocoding
+    # stays serialized in the main thread (Nominatim rate-limits us anyway).
+    # Copying is deferred to pass 2 so it can run grouped by destination
+    # directory instead of hopping between directories per file.
+    entries = []
+    read = len(stats['paths'])
+    max_workers = os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        paths = iter(files)
+        pending = {}
+
+        def submit_next():
+            ''' Submit the next unprocessed path into the pool, if any. '''
+            for path, size in paths:
+                key = os.fspath(path)
+                if key in stats['paths']:
+                    continue
+                cached = stats['mediacache'].get(key)
+                if cached is not None:
+                    # Probed before an interruption; skip EXIF/ffprobe.
+                    future = concurrent.futures.Future()
+                    future.set_result(MediaFile.from_cache(path, size, *cached))
+                    pending[future] = path
+                else:
+                    pending[executor.submit(MediaFile, path, size)] = path
+                return
+
+        # Keep roughly two futures per worker in flight to bound memory.
+        for _ in range(max_workers * 2):
+            submit_next()
+
+        while pending and not interrupted:
+            if _STOP.is_set():
+                logging.info('Keyboard interrupt')
+                for future in pending:
+                    future.cancel()
                 interrupted = True
                 break
 
-        if path in stats['paths']:
-            continue
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                key = os.fspath(path)
+                submit_next()
+                read += 1
+
+                try:
+                    media = future.result()
+                    # Remember the probe result until placement succeeds,
+                    # so an interruption in between never re-probes.
+                    stats['mediacache'][key] = (media.date, media.coordinates)
+                    media.resolve_location(locator)
+                    # Sort key precomputed here; strings compare cheaper
+                    # than PurePath objects.
+                    entries.append(
+                        (os.fspath(media.dest_directory(args.dest_directory)),
+                         media))
+                    logging.debug('%s read', path)
+                    if log_progress and read % _PROGRESS_EVERY == 0:
+                        logging.info('[%d/%d] read', read, total)
+                except geopy.exc.GeocoderUnavailable:
+                    logging.error('Could not fetch geolocation (too many requests?)')
+                    interrupted = True
+                    break
+                except UnknownMedia:
+                    logging.warning('[%d/%d] %s (ignored)', read, total, path)
+                    mark_processed(key)
+                except Exception as general_exception:
+                    # TODO: print whole stack
+                    logging.error('Sorting media failed: %s\n%s', general_exception, traceback.format_exc())
+                    interrupted = True
+                    break
+
+        if interrupted:
+            for future in pending:
+                future.cancel()
+
+    # Pass 2: place files grouped by destination directory (and by date
+    # within it), so each directory is created exactly once and writes hit
+    # the destination's metadata cache warm.
+    if not interrupted:
+        entries.sort(
+            key=lambda e: (e[0], e[1].date or datetime.datetime.min))
+        placeable = len(entries)
+        last_dir = None
+        for position, (_, media) in enumerate(entries, start=1):
+            if _STOP.is_set():
+                logging.info('Keyboard interrupt')
+                interrupted = True
+                break
 
-        try:
-            media = MediaFile(pathlib.Path(path), locator)
-            dst_path = pathlib.Path()
+            key = os.fspath(media.path)
             try:
                 dst_path = media.dest_path(args.dest_directory)
-                logging.info('[%d/%s, %.2fGB, %sdups] %s -> %s', 
-                    1 + len(stats['paths']),
-                    len(files),
-                    stats['bytes'] / 1024 / 1024 / 1024,
-                    stats['duplicates'],
-                    path,
-                    dst_path)
+                logging.debug('%s -> %s', media.path, dst_path)
+                if log_progress and position % _PROGRESS_EVERY == 0:
+                    logging.info('[%d/%d, %.2fGB, %sdups] %s -> %s',
+                        position,
+                        placeable,
+                        stats['bytes'] * _GB,
+                        stats['duplicates'],
+                        media.path,
+                        dst_path)
+
+                if not args.dryrun:
+                    if dst_path.parent != last_dir:
+                        os.makedirs(dst_path.parent, exist_ok=True)
+                        last_dir = dst_path.parent
+                    media.copy(dst_path)
+                mark_processed(key)
+                stats['mediacache'].pop(key, None)
+                stats['bytes'] += media.size
             except DuplicateException as de:
-                logging.info('[%d/%s, %.2fGB, %sdups] %s (%s)', 
-                    1 + len(stats['paths']),
-                    len(files),
-                    stats['bytes'] / 1024 / 1024 / 1024,
-                    stats['duplicates'],
-                    path,
-                    de)
-                raise de
-            
-            if not args.dryrun:
-                media.copy(dst_path)
-            stats['paths'].add(path)
-            stats['bytes'] += media.size
-        except geopy.exc.GeocoderUnavailable:
-            logging.error('Could not fetch geolocation (too many requests?)')
-            interrupted = True
-            break
-        except UnknownMedia:
-            logging.warning('[%d/%s, %.2fGB, %sdups] %s (ignored)', 
-                1 + len(stats['paths']),
-                len(files),
-                stats['bytes'] / 1024 / 1024 / 1024,
-                stats['duplicates'],
-                path)
-            stats['paths'].add(path)
-        except DuplicateException:
-            stats['duplicates'] += 1
-            stats['paths'].add(path)
-        except Exception as general_exception:
-            # TODO: print whole stack
-            logging.error('Sorting media failed: %s\n%s', general_exception, traceback.format_exc())
-            interrupted = True
-            break
+                # Rare enough to keep at INFO.
+                if log_progress:
+                    logging.info('[%d/%d, %.2fGB, %sdups] %s (%s)',
+                        position,
+                        placeable,
+                        stats['bytes'] * _GB,
+                        stats['duplicates'],
+                        media.path,
+                        de)
+                stats['duplicates'] += 1
+                mark_processed(key)
+                stats['mediacache'].pop(key, None)
+            except KeyboardInterrupt:
+                # Raised by _fastcopy when SIGINT lands mid-copy; the
+                # half-written destination file is already removed. Take
+                # the same exit as the top-of-loop _STOP check so the run
+                # stays resumable.
+                logging.info('Keyboard interrupt')
+                interrupted = True
+                break
+            except Exception as general_exception:
+                # TODO: print whole stack
+                logging.error('Sorting media failed: %s\n%s', general_exception, traceback.format_exc())
+                interrupted = True
+                break
 
+    paths_log.close()
     if interrupted:
-        with open(INTERRUPT_PICKLE, 'wb') as file:
-            pickle.dump(stats, file)
+        flush_stats()
     else:
+        atexit.unregister(flush_stats)
         logging.info('Finished')
-        if os.path.exists(INTERRUPT_PICKLE):
-            logging.info('Remove %s', INTERRUPT_PICKLE)
-            os.remove(INTERRUPT_PICKLE)
+        for leftover in (INTERRUPT_PICKLE, PATHS_LOG):
+            if os.path.exists(leftover):
+                logging.info('Remove %s', leftover)
+                os.remove(leftover)
 
 if __name__ == '__main__':
     main()